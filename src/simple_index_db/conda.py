@@ -1,27 +1,104 @@
+import atexit
+import os
+import pickle
+from collections import defaultdict
 from functools import lru_cache
+from pathlib import Path
+from types import MappingProxyType
 
-import requests
+import httpx
+import orjson
 
 MAPPING_URL = "https://raw.githubusercontent.com/prefix-dev/parselmouth/main/files/v0/conda-forge/compressed_mapping.json"
 
+CACHE_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "simple_index_db"
+)
+MAPPING_CACHE_PATH = CACHE_DIR / "mapping.pickle"
 
-@lru_cache(maxsize=None)
-def _load_mapping():
-    r = requests.get(MAPPING_URL)
-    r.raise_for_status()
-    return r.json()
+_client = httpx.Client(
+    http2=True,
+    timeout=30,
+    follow_redirects=True,
+    limits=httpx.Limits(max_keepalive_connections=4),
+)
+atexit.register(_client.close)
 
 
-@lru_cache(maxsize=None)
-def _load_reverse_mapping():
-    mapping = _load_mapping()
-    reverse_mapping = {}
+def _build_reverse_mapping(mapping):
+    reverse_mapping = defaultdict(list)
+    get_conda_names = reverse_mapping.__getitem__
     for conda_name, pypi_names in mapping.items():
         if pypi_names is None:
             continue
         for pypi_name in pypi_names:
-            reverse_mapping.setdefault(pypi_name, []).append(conda_name)
-    return reverse_mapping
+            get_conda_names(pypi_name).append(conda_name)
+    return dict(reverse_mapping)
+
+
+def _read_mapping_cache():
+    try:
+        with MAPPING_CACHE_PATH.open("rb") as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def _write_mapping_cache(cache):
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = MAPPING_CACHE_PATH.with_suffix(".tmp")
+        with tmp_path.open("wb") as f:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp_path.replace(MAPPING_CACHE_PATH)
+    except OSError:
+        pass
+
+
+@lru_cache(maxsize=None)
+def _load_mappings():
+    """
+    Load the conda-forge to PyPI mapping together with its reverse.
+
+    Both are kept in an on-disk cache, which is revalidated against the server with
+    the stored ETag and Last-Modified headers, so that warm starts skip downloading,
+    parsing, and inverting the mapping.
+
+    :return: A tuple of (mapping, reverse_mapping).
+    """
+    cache = _read_mapping_cache()
+    headers = {}
+    if cache is not None:
+        if cache.get("etag") is not None:
+            headers["If-None-Match"] = cache["etag"]
+        if cache.get("last_modified") is not None:
+            headers["If-Modified-Since"] = cache["last_modified"]
+    r = _client.get(MAPPING_URL, headers=headers)
+    if r.status_code == 304 and cache is not None:
+        return cache["mapping"], cache["reverse_mapping"]
+    r.raise_for_status()
+    mapping = orjson.loads(r.content)
+    reverse_mapping = _build_reverse_mapping(mapping)
+    etag = r.headers.get("ETag")
+    last_modified = r.headers.get("Last-Modified")
+    if etag is not None or last_modified is not None:
+        _write_mapping_cache(
+            {
+                "etag": etag,
+                "last_modified": last_modified,
+                "mapping": mapping,
+                "reverse_mapping": reverse_mapping,
+            }
+        )
+    return mapping, reverse_mapping
+
+
+def _load_mapping():
+    return _load_mappings()[0]
+
+
+def _load_reverse_mapping():
+    return _load_mappings()[1]
 
 
 def get_conda_packages():
@@ -30,8 +107,8 @@ def get_conda_packages():
 
     :return: Conda package names together with names of PyPI packages they depend on.
     """
-    mapping = _load_mapping().copy()
-    return mapping
+    # A read-only view protects the cached mapping without copying it
+    return MappingProxyType(_load_mapping())
 
 
 def get_pypi_packages():
@@ -40,8 +117,7 @@ def get_pypi_packages():
 
     :return: PyPI package names together with names of conda package that depend on them.
     """
-    reverse_mapping = _load_reverse_mapping().copy()
-    return reverse_mapping
+    return MappingProxyType(_load_reverse_mapping())
 
 
 def conda_to_pypi(conda_pkg_name: str) -> str | None:
@@ -63,4 +139,4 @@ def pypi_to_conda(pypi_pkg_name: str) -> list[str]:
     :return: A list of corresponding conda package names, or an empty list if not found.
     """
     reverse_mapping = _load_reverse_mapping()
-    return reverse_mapping.get(pypi_pkg_name, [])
\ No newline at end of file
+    return reverse_mapping.get(pypi_pkg_name, [])
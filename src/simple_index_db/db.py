@@ -1,7 +1,9 @@
 import enum
 import re
-from threading import Lock
-from typing import Self
+from collections import defaultdict
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
 
 from packaging.version import InvalidVersion
 from packaging.version import parse as parse_version
@@ -9,30 +11,64 @@ from rich.console import Console
 from sqlalchemy import (
     Column,
     ForeignKey,
+    Index,
+    LargeBinary,
+    SmallInteger,
     Table,
+    TypeDecorator,
+    UniqueConstraint,
     create_engine,
     event,
+    insert,
     select,
 )
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import (
     DeclarativeBase,
     Mapped,
+    WriteOnlyMapped,
     mapped_column,
     relationship,
     sessionmaker,
 )
 
-BUILD_TAG_REGEX = re.compile(r"^(?P<build_number>[0-9]+)(?P<build_string>.*)$")
+WHEEL_FILENAME_REGEX = re.compile(
+    r"(?P<name>[^-]+)-(?P<version>[^-]+)(?:-(?P<build>[0-9][^-]*))?"
+    r"-(?P<python>[^-]+)-(?P<abi>[^-]+)-(?P<platform>[^-]+)\.whl"
+)
+
+# Common subset of valid versions, e.g. 1.2.3, 2.0rc1, 1.0.post2, or 3.1.dev0
+SIMPLE_VERSION_REGEX = re.compile(
+    r"[0-9]+(?:\.[0-9]+){0,3}(?:(?:a|b|c|rc)[0-9]+|\.post[0-9]+|\.dev[0-9]+)?"
+)
+
+# Name, version, build, python, abi, and platform tag of a wheel filename
+WheelParts = tuple[str, str, str | None, str, str, str]
 
 engine = None
 
 
+def parse_build_tag(build_tag_str: str) -> tuple[int, str]:
+    """Split a build tag into its leading build number and the trailing string."""
+    end = 0
+    length = len(build_tag_str)
+    while end < length and "0" <= build_tag_str[end] <= "9":
+        end += 1
+    if end == 0:
+        raise ValueError(f"Invalid build tag string: {build_tag_str}")
+    return int(build_tag_str[:end]), build_tag_str[end:]
+
+
 class TagCache:
-    """Thread-safe cache for tracking known tag strings to avoid redundant existence checks."""
+    """
+    Cache for tracking known tag strings to avoid redundant existence checks.
+
+    Only the single database writer adds to it, and single dict operations are atomic
+    under the GIL, so no lock is needed.
+    """
 
     def __init__(self):
         self._known_tags = dict()
-        self._lock = Lock()
         self._loaded = False
 
     def contains(self, tag_str: str) -> bool:
@@ -43,16 +79,18 @@ class TagCache:
         """Get the ID of a known tag string, or None if not known."""
         return self._known_tags.get(tag_str, None)
 
+    def __getitem__(self, tag_str: str) -> int:
+        """Get the ID of a tag string that must be known."""
+        return self._known_tags[tag_str]
+
     def add(self, tag_str: str, id: int):
         """Mark a tag string as known to exist."""
-        with self._lock:
-            self._known_tags[tag_str] = id
+        self._known_tags[tag_str] = id
 
-    def load_from_query(self, tag_strings: list[tuple[str, int]]):
-        """Bulk load known tag strings."""
-        with self._lock:
-            self._known_tags.update(tag_strings)
-            self._loaded = True
+    def load_from_query(self, tag_strings: Iterable[tuple[str, int]]):
+        """Bulk load known tag strings, replacing the current contents."""
+        self._known_tags = dict(tag_strings)
+        self._loaded = True
 
     def is_loaded(self) -> bool:
         """Check if cache has been pre-loaded."""
@@ -63,12 +101,29 @@ class TagCache:
         return len(self._known_tags)
 
 
-# Global caches for each tag type
+# Global caches for each tag type. They are only used by the thread that writes to
+# the database; the fetch thread merely parses, so the caches are never shared.
 _version_cache = TagCache()
 _build_tag_cache = TagCache()
 _python_tag_cache = TagCache()
 _abi_tag_cache = TagCache()
 _platform_tag_cache = TagCache()
+_hash_algorithm_cache = TagCache()
+
+# Maximum number of values bound into a single IN clause
+IN_CLAUSE_CHUNK_SIZE = 500
+
+
+def _is_vss(version_str: str) -> bool:
+    """Check whether a version string is valid per the version specifier spec."""
+    # Most versions are plain release segments; skip the full parse for those
+    if SIMPLE_VERSION_REGEX.fullmatch(version_str) is not None:
+        return True
+    try:
+        parse_version(version_str)
+    except InvalidVersion:
+        return False
+    return True
 
 
 class ProjectStatus(enum.Enum):
@@ -78,6 +133,35 @@ class ProjectStatus(enum.Enum):
     DEPRECATED = "deprecated"
 
 
+_STATUS_TO_INT = {status: i for i, status in enumerate(ProjectStatus, 1)}
+_INT_TO_STATUS = {i: status for status, i in _STATUS_TO_INT.items()}
+
+
+class ProjectStatusType(TypeDecorator):
+    """Stores a ProjectStatus as a small integer instead of its name."""
+
+    impl = SmallInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else _STATUS_TO_INT[value]
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else _INT_TO_STATUS[value]
+
+
+def execute_in_chunks(session, make_stmt, values):
+    """
+    Execute a statement with an IN clause for chunks of values, yielding all rows.
+
+    :param make_stmt: Builds the statement for a chunk of values.
+    :param values: The values to split up, so that no statement binds too many.
+    """
+    values = list(values)
+    for i in range(0, len(values), IN_CLAUSE_CHUNK_SIZE):
+        yield from session.execute(make_stmt(values[i : i + IN_CLAUSE_CHUNK_SIZE]))
+
+
 class Base(DeclarativeBase):
     pass
 
@@ -105,48 +189,33 @@ class Version(Base):
     version: Mapped[str] = mapped_column(index=True, unique=True)
     is_valid_vss: Mapped[bool]
 
-    @classmethod
-    def from_str(cls, session, version_str: str) -> Self:
-        # Check if we know this version exists (avoids query)
-        if version_id := _version_cache.get_id(version_str):
-            version: Self = session.get_one(Version, version_id)
-            return version
-
-        # Might not exist, check database
-        version: Self = session.execute(
-            select(Version).filter_by(version=version_str)
-        ).scalar_one_or_none()
-
-        if version is not None:
-            _version_cache.add(version_str, version.id)
-            return version
-
-        # Create new version
-        try:
-            parse_version(version_str)
-            is_valid_vss = True
-        except InvalidVersion:
-            is_valid_vss = False
-
-        version = cls(version=version_str, is_valid_vss=is_valid_vss)
-        session.add(version)
-        _version_cache.add(version_str, version.id)
-        return version
+    @staticmethod
+    def row(version_str: str) -> dict:
+        return {"version": version_str, "is_valid_vss": _is_vss(version_str)}
+
+
+class HashAlgorithm(Base):
+    __tablename__ = "hash_algorithm"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(index=True, unique=True)
+
+    @staticmethod
+    def row(name: str) -> dict:
+        return {"name": name}
 
 
 class Hash(Base):
     __tablename__ = "hash"
+    __table_args__ = (UniqueConstraint("file_id", "algorithm_id"),)
 
     id: Mapped[int] = mapped_column(primary_key=True)
     file_id: Mapped[int] = mapped_column(ForeignKey("file.id"))
     file: Mapped["File"] = relationship(back_populates="hashes")
-    algorithm: Mapped[str]
-    hash_value: Mapped[str]
-
-    @classmethod
-    def from_info(cls, session, algorithm: str, hash_value: str) -> Self:
-        hash_obj = cls(algorithm=algorithm, hash_value=hash_value)
-        return hash_obj
+    algorithm_id: Mapped[int] = mapped_column(ForeignKey("hash_algorithm.id"))
+    algorithm: Mapped[HashAlgorithm] = relationship()
+    # Raw digest bytes, decoded from the hex string served by the index
+    hash_value: Mapped[bytes] = mapped_column(LargeBinary)
 
 
 class BuildTag(Base):
@@ -157,39 +226,14 @@ class BuildTag(Base):
     build_number: Mapped[int]
     build_string: Mapped[str | None]
 
-    @classmethod
-    def from_str(cls, session, build_tag_str: str) -> Self | None:
-        if build_tag_str is None or build_tag_str == "":
-            return None
-
-        # Check if we know this build tag exists (avoids query)
-        if tag_id := _build_tag_cache.get_id(build_tag_str):
-            build_tag: Self = session.get_one(BuildTag, tag_id)
-            return build_tag
-
-        # Might not exist, check database
-        build_tag: Self = session.execute(
-            select(BuildTag).filter_by(tag=build_tag_str)
-        ).scalar_one_or_none()
-
-        if build_tag is not None:
-            _build_tag_cache.add(build_tag_str, build_tag.id)
-            return build_tag
-
-        # Create new build tag
-        m = BUILD_TAG_REGEX.match(build_tag_str)
-        if m is None:
-            raise ValueError(f"Invalid build tag string: {build_tag_str}")
-        build_number = int(m.group("build_number"))
-        build_string = m.group("build_string")
-        build_tag = cls(
-            tag=build_tag_str,
-            build_number=build_number,
-            build_string=build_string,
-        )
-        session.add(build_tag)
-        _build_tag_cache.add(build_tag_str, build_tag.id)
-        return build_tag
+    @staticmethod
+    def row(build_tag_str: str) -> dict:
+        build_number, build_string = parse_build_tag(build_tag_str)
+        return {
+            "tag": build_tag_str,
+            "build_number": build_number,
+            "build_string": build_string,
+        }
 
 
 class PythonTag(Base):
@@ -198,27 +242,9 @@ class PythonTag(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     tag: Mapped[str] = mapped_column(index=True, unique=True)
 
-    @classmethod
-    def from_str(cls, session, tag_str: str) -> Self:
-        # Check if we know this python tag exists (avoids query)
-        if tag_id := _python_tag_cache.get_id(tag_str):
-            python_tag: Self = session.get_one(PythonTag, tag_id)
-            return python_tag
-
-        # Might not exist, check database
-        python_tag: Self = session.execute(
-            select(PythonTag).filter_by(tag=tag_str)
-        ).scalar_one_or_none()
-
-        if python_tag is not None:
-            _python_tag_cache.add(tag_str, python_tag.id)
-            return python_tag
-
-        # Create new python tag
-        python_tag = cls(tag=tag_str)
-        session.add(python_tag)
-        _python_tag_cache.add(tag_str, python_tag.id)
-        return python_tag
+    @staticmethod
+    def row(tag_str: str) -> dict:
+        return {"tag": tag_str}
 
 
 class AbiTag(Base):
@@ -227,27 +253,9 @@ class AbiTag(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     tag: Mapped[str] = mapped_column(index=True, unique=True)
 
-    @classmethod
-    def from_str(cls, session, tag_str: str) -> Self:
-        # Check if we know this abi tag exists (avoids query)
-        if tag_id := _abi_tag_cache.get_id(tag_str):
-            abi_tag: Self = session.get_one(AbiTag, tag_id)
-            return abi_tag
-
-        # Might not exist, check database
-        abi_tag: Self = session.execute(
-            select(AbiTag).filter_by(tag=tag_str)
-        ).scalar_one_or_none()
-
-        if abi_tag is not None:
-            _abi_tag_cache.add(tag_str, abi_tag.id)
-            return abi_tag
-
-        # Create new abi tag
-        abi_tag = cls(tag=tag_str)
-        session.add(abi_tag)
-        _abi_tag_cache.add(tag_str, abi_tag.id)
-        return abi_tag
+    @staticmethod
+    def row(tag_str: str) -> dict:
+        return {"tag": tag_str}
 
 
 class PlatformTag(Base):
@@ -256,27 +264,9 @@ class PlatformTag(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     tag: Mapped[str] = mapped_column(index=True, unique=True)
 
-    @classmethod
-    def from_str(cls, session, tag_str: str) -> Self:
-        # Check if we know this platform tag exists (avoids query)
-        if tag_id := _platform_tag_cache.get_id(tag_str):
-            platform_tag: Self = session.get_one(PlatformTag, tag_id)
-            return platform_tag
-
-        # Might not exist, check database
-        platform_tag: Self = session.execute(
-            select(PlatformTag).filter_by(tag=tag_str)
-        ).scalar_one_or_none()
-
-        if platform_tag is not None:
-            _platform_tag_cache.add(tag_str, platform_tag.id)
-            return platform_tag
-
-        # Create new platform tag
-        platform_tag = cls(tag=tag_str)
-        session.add(platform_tag)
-        _platform_tag_cache.add(tag_str, platform_tag.id)
-        return platform_tag
+    @staticmethod
+    def row(tag_str: str) -> dict:
+        return {"tag": tag_str}
 
 
 class Wheel(Base):
@@ -296,100 +286,79 @@ class Wheel(Base):
     platform_tag_id: Mapped[int] = mapped_column(ForeignKey("platform_tag.id"))
     platform_tag: Mapped[PlatformTag] = relationship()
 
-    @classmethod
-    def from_file(cls, session, file: "File") -> Self | None:
-        filename = file.filename
-        assert filename.endswith(".whl")
-        wheel_name = filename[:-4]
-        parts = wheel_name.split("-")
-        if len(parts) < 5 or len(parts) > 6:
+    @staticmethod
+    def parse_filename(filename: str) -> WheelParts | None:
+        """Split a wheel filename into its components, or return None if invalid."""
+        m = WHEEL_FILENAME_REGEX.fullmatch(filename)
+        if m is None:
             return None
-        if len(parts) == 5:
-            (
-                name,
-                version_str,
-                python_tag_str,
-                abi_tag_str,
-                platform_tag_str,
-            ) = parts
-            build_tag = None
-        else:
-            (
-                name,
-                version_str,
-                build_tag_str,
-                python_tag_str,
-                abi_tag_str,
-                platform_tag_str,
-            ) = parts
-            try:
-                build_tag = BuildTag.from_str(session, build_tag_str)
-            except ValueError:
-                return None
-        version = Version.from_str(session, version_str)
-        return cls(
-            version=version,
-            build_tag=build_tag,
-            python_tag=PythonTag.from_str(session, python_tag_str),
-            abi_tag=AbiTag.from_str(session, abi_tag_str),
-            platform_tag=PlatformTag.from_str(session, platform_tag_str),
-        )
+        return m.group("name", "version", "build", "python", "abi", "platform")
+
+    @staticmethod
+    def row_from_parts(parts: WheelParts) -> dict:
+        """Build the column values of a wheel row from its prefetched tag ids."""
+        (
+            name,
+            version_str,
+            build_tag_str,
+            python_tag_str,
+            abi_tag_str,
+            platform_tag_str,
+        ) = parts
+        return {
+            "version_id": _version_cache[version_str],
+            "build_tag_id": _build_tag_cache[build_tag_str] if build_tag_str else None,
+            "python_tag_id": _python_tag_cache[python_tag_str],
+            "abi_tag_id": _abi_tag_cache[abi_tag_str],
+            "platform_tag_id": _platform_tag_cache[platform_tag_str],
+        }
 
 
 class File(Base):
     __tablename__ = "file"
+    __table_args__ = (
+        # Covers the per-project filename (and rowid) lookups without row fetches
+        Index("ix_file_project_id_filename", "project_id", "filename"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    project_id: Mapped[int] = mapped_column(ForeignKey("project.id"), index=True)
+    project_id: Mapped[int] = mapped_column(ForeignKey("project.id"))
     project: Mapped["Project"] = relationship(back_populates="files")
     filename: Mapped[str] = mapped_column(index=True, unique=True)
     url: Mapped[str]
-    hashes: Mapped[set[Hash]] = relationship(
+    hashes: Mapped[list[Hash]] = relationship(
         back_populates="file", cascade="all, delete-orphan"
     )
     requires_python: Mapped[str | None]
-    core_metadata: Mapped[str | None]
-    gpg_signature: Mapped[str | None]
+    # Potentially large and rarely read, so only loaded on access
+    core_metadata: Mapped[str | None] = mapped_column(deferred=True)
+    gpg_signature: Mapped[str | None] = mapped_column(deferred=True)
     yanked: Mapped[bool]
-    yanked_reason: Mapped[str | None]
+    yanked_reason: Mapped[str | None] = mapped_column(deferred=True)
     size: Mapped[int]
     upload_time: Mapped[str | None]
-    provenance: Mapped[str | None]
+    provenance: Mapped[str | None] = mapped_column(deferred=True)
     wheel: Mapped[Wheel | None] = relationship(
         back_populates="file", cascade="all, delete-orphan"
     )
 
-    @classmethod
-    def from_info(cls, session, file_info: dict) -> Self:
-        filename = file_info["filename"]
-        hashes = {
-            Hash.from_info(session, algorithm, hash_value)
-            for algorithm, hash_value in file_info.get("hashes", {}).items()
-        }
+    @staticmethod
+    def row_from_info(file_info: dict) -> dict:
+        """Build the column values of a file row from its simple API info."""
+        # Either a boolean or a non-empty string giving the reason
         yanked_value = file_info.get("yanked", False)
-        if yanked_value:
-            yanked_reason = yanked_value
-            yanked = True
-        else:
-            yanked_reason = None
-            yanked = False
-        file = cls(
-            filename=filename,
-            url=file_info["url"],
-            hashes=hashes,
-            requires_python=file_info.get("requires-python", None),
-            core_metadata=None,  # file_info.get("core-metadata", None),
-            gpg_signature=None,  # file_info.get("gpg-signature", None),
-            yanked=yanked,
-            yanked_reason=yanked_reason,
-            size=file_info.get("size", 0),
-            upload_time=file_info.get("upload-time", None),
-            provenance=file_info.get("provenance", None),
-            wheel=None,
-        )
-        if filename.endswith(".whl"):
-            file.wheel = Wheel.from_file(session, file)
-        return file
+        return {
+            "filename": file_info["filename"],
+            "url": file_info["url"],
+            "requires_python": file_info.get("requires-python", None),
+            "core_metadata": None,  # file_info.get("core-metadata", None),
+            "gpg_signature": None,  # file_info.get("gpg-signature", None),
+            "yanked": bool(yanked_value),
+            "yanked_reason": yanked_value if isinstance(yanked_value, str) else None,
+            "size": file_info.get("size", 0),
+            "upload_time": file_info.get("upload-time", None),
+            "provenance": file_info.get("provenance", None),
+        }
 
 
 class Project(Base):
@@ -397,53 +366,192 @@ class Project(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(index=True, unique=True)
-    files: Mapped[set[File]] = relationship(
-        back_populates="project", cascade="all, delete-orphan"
+    # Write-only so that adding files never loads the whole collection
+    files: WriteOnlyMapped[File] = relationship(
+        back_populates="project", cascade="all, delete-orphan", passive_deletes=True
+    )
+    versions: Mapped[list[Version]] = relationship(
+        secondary=project_version_association
     )
-    versions: Mapped[set[Version]] = relationship(secondary=project_version_association)
     last_serial: Mapped[int]
-    status: Mapped[ProjectStatus | None]
+    status: Mapped[ProjectStatus | None] = mapped_column(ProjectStatusType)
     status_reason: Mapped[str | None]
 
-    @classmethod
-    def from_info(cls, session, project_last_serial, project_info) -> Self:
+    @staticmethod
+    def _status_from_info(project_info) -> ProjectStatus | None:
         status = project_info.get("project-status", {}).get("status", None)
         if status is not None:
             status = ProjectStatus(status)
-        versions = {
-            Version.from_str(session, v) for v in project_info.get("versions", [])
-        }
-        files = {File.from_info(session, f) for f in project_info.get("files", [])}
-        return cls(
-            name=project_info["name"],
-            last_serial=project_last_serial,
-            status=status,
-            status_reason=project_info.get("project-status-reason", None),
-            versions=versions,
-            files=files,
-        )
+        return status
 
-    def update_from_info(self, session, project_last_serial, project_info) -> None:
-        status = project_info.get("project-status", {}).get("status", None)
-        if status is not None:
-            status = ProjectStatus(status)
-        self.status = status
-        self.status_reason = project_info.get("project-status-reason", None)
-        old_versions = {v.version for v in self.versions}
-        new_versions = {
-            Version.from_str(session, v)
-            for v in project_info.get("versions", [])
-            if v not in old_versions
-        }
-        self.versions |= new_versions
-        old_files = {f.filename for f in self.files}
-        new_files = {
-            File.from_info(session, f)
-            for f in project_info.get("files", [])
-            if f["filename"] not in old_files
+    @classmethod
+    def bulk_ingest(cls, session, projects) -> dict[str, int]:
+        """
+        Add or update projects together with their versions, files, hashes, and wheels.
+
+        Bypasses the unit of work: the project rows of all projects are upserted with
+        a single statement, and the versions and files that aren't known yet are
+        added with one bulk INSERT per table, using the ids of the project and file
+        rows to link the dependent rows.
+
+        :param projects: Tuples of (project_last_serial, project_info, parsed), where
+                         parsed is the result of parse_project or None if it hasn't
+                         been computed yet.
+        :return: The ids of the projects, keyed by name.
+        """
+        project_rows = []
+        parsed_projects = {}
+        for project_last_serial, project_info, parsed in projects:
+            if parsed is None:
+                parsed = parse_project(project_info)
+            prefetch_project(session, parsed)
+            parsed_projects[project_info["name"]] = parsed
+            project_rows.append(
+                {
+                    "name": project_info["name"],
+                    "last_serial": project_last_serial,
+                    "status": cls._status_from_info(project_info),
+                    "status_reason": project_info.get("project-status-reason", None),
+                }
+            )
+        if not project_rows:
+            return {}
+        names = list(parsed_projects)
+        existing_ids = dict(
+            execute_in_chunks(
+                session,
+                lambda chunk: select(Project.name, Project.id).where(
+                    Project.name.in_(chunk)
+                ),
+                names,
+            )
+        )
+        # Core statements on the tables skip the ORM bulk machinery. SQLite cannot
+        # batch INSERT ... RETURNING with a guaranteed row order, so upsert in bulk
+        # and look the ids of the new projects up by name afterwards.
+        stmt = sqlite_insert(Project.__table__)
+        session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["name"],
+                set_={
+                    column: stmt.excluded[column]
+                    for column in ("last_serial", "status", "status_reason")
+                },
+            ),
+            project_rows,
+        )
+        project_ids = existing_ids | dict(
+            execute_in_chunks(
+                session,
+                lambda chunk: select(Project.name, Project.id).where(
+                    Project.name.in_(chunk)
+                ),
+                [name for name in names if name not in existing_ids],
+            )
+        )
+        # Versions and files already stored for the existing projects are skipped
+        old_version_ids = defaultdict(set)
+        for project_id, version_id in execute_in_chunks(
+            session,
+            lambda chunk: select(
+                project_version_association.c.project_id,
+                project_version_association.c.version_id,
+            ).where(project_version_association.c.project_id.in_(chunk)),
+            existing_ids.values(),
+        ):
+            old_version_ids[project_id].add(version_id)
+        old_files = {
+            filename
+            for (filename,) in execute_in_chunks(
+                session,
+                lambda chunk: select(File.filename).where(File.project_id.in_(chunk)),
+                existing_ids.values(),
+            )
         }
-        self.files |= new_files
-        self.last_serial = project_last_serial
+        version_rows = []
+        new_files = []
+        for _, project_info, _ in projects:
+            name = project_info["name"]
+            project_id = project_ids[name]
+            known_version_ids = old_version_ids.get(project_id, ())
+            version_rows.extend(
+                cls._version_rows(
+                    project_id,
+                    {
+                        v
+                        for v in project_info.get("versions", [])
+                        if _version_cache[v] not in known_version_ids
+                    },
+                )
+            )
+            new_file_infos = [
+                f
+                for f in project_info.get("files", [])
+                if f["filename"] not in old_files
+            ]
+            new_files.append((project_id, new_file_infos, parsed_projects[name]))
+        if version_rows:
+            session.execute(insert(project_version_association), version_rows)
+        cls._insert_files(session, new_files)
+        return project_ids
+
+    @staticmethod
+    def _version_rows(project_id, versions) -> list[dict]:
+        """Build the association rows linking a project to (prefetched) versions."""
+        return [
+            {"project_id": project_id, "version_id": _version_cache[v]}
+            for v in versions
+        ]
+
+    @staticmethod
+    def _insert_files(session, new_files) -> None:
+        """
+        Insert new files of projects together with their hashes and wheels.
+
+        :param new_files: Tuples of (project_id, file_infos, parsed).
+        """
+        file_rows = []
+        for project_id, file_infos, _ in new_files:
+            for file_info in file_infos:
+                file_row = File.row_from_info(file_info)
+                file_row["project_id"] = project_id
+                file_rows.append(file_row)
+        if not file_rows:
+            return
+        # As for projects, insert in bulk and look the new ids up afterwards
+        session.execute(insert(File.__table__), file_rows)
+        file_ids = dict(
+            execute_in_chunks(
+                session,
+                lambda chunk: select(File.filename, File.id).where(
+                    File.filename.in_(chunk)
+                ),
+                [file_row["filename"] for file_row in file_rows],
+            )
+        )
+        hash_rows = []
+        wheel_rows = []
+        for _, file_infos, parsed in new_files:
+            for file_info in file_infos:
+                filename = file_info["filename"]
+                file_id = file_ids[filename]
+                for algorithm, hash_value in parsed.hashes[filename].items():
+                    hash_rows.append(
+                        {
+                            "file_id": file_id,
+                            "algorithm_id": _hash_algorithm_cache[algorithm],
+                            "hash_value": hash_value,
+                        }
+                    )
+                # Wheel filenames were already parsed while prefetching the tags
+                if (parts := parsed.wheel_parts.get(filename)) is not None:
+                    wheel_row = Wheel.row_from_parts(parts)
+                    wheel_row["file_id"] = file_id
+                    wheel_rows.append(wheel_row)
+        if hash_rows:
+            session.execute(insert(Hash.__table__), hash_rows)
+        if wheel_rows:
+            session.execute(insert(Wheel.__table__), wheel_rows)
 
 
 class LogEntry(Base):
@@ -456,6 +564,137 @@ class LogEntry(Base):
     num_updated_projects: Mapped[int]
     num_added_projects: Mapped[int]
     num_total_projects: Mapped[int]
+    # None for entries written before failed fetches were counted
+    num_failed_projects: Mapped[int | None]
+
+
+def _prefetch(session, tag_cache: TagCache, model, column, strings):
+    """
+    Make sure every string has a row whose id is in the global tag cache.
+
+    Once the tag cache holds the whole table, strings missing from it are new, so no
+    query is needed to find them. They are inserted with INSERT OR IGNORE, which
+    also tolerates rows that exist without being cached, and their ids are then read
+    back with a single query per chunk.
+    """
+    missing = [s for s in strings if not tag_cache.contains(s)]
+    for i in range(0, len(missing), IN_CLAUSE_CHUNK_SIZE):
+        chunk = missing[i : i + IN_CLAUSE_CHUNK_SIZE]
+        # Insert into the table rather than the entity to skip the ORM bulk path
+        session.execute(
+            insert(model.__table__).prefix_with("OR IGNORE"),
+            [model.row(s) for s in chunk],
+        )
+        for key, id in session.execute(
+            select(column, model.id).where(column.in_(chunk))
+        ):
+            tag_cache.add(key, id)
+
+
+class ParsedProject(NamedTuple):
+    """The wheel filename components, hashes, and lookup strings of a project."""
+
+    wheel_parts: dict[str, WheelParts]
+    # Decoded digests of each file, keyed by filename and then by algorithm
+    hashes: dict[str, dict[str, bytes]]
+    version_strs: set[str]
+    build_tag_strs: set[str]
+    python_tag_strs: set[str]
+    abi_tag_strs: set[str]
+    platform_tag_strs: set[str]
+    hash_algorithm_strs: set[str]
+
+
+def parse_project(project_info) -> ParsedProject:
+    """
+    Collect every version, tag, and hash algorithm string referenced by a project.
+
+    Also decodes the hex digests of its files.
+
+    Doesn't touch the database, so it can run in the fetch thread's event loop while
+    the writer is busy with other projects.
+    """
+    version_strs = set(project_info.get("versions", []))
+    build_tag_strs = set()
+    python_tag_strs = set()
+    abi_tag_strs = set()
+    platform_tag_strs = set()
+    hash_algorithm_strs = set()
+    wheel_parts = {}
+    hashes = {}
+    for file_info in project_info.get("files", []):
+        filename = file_info["filename"]
+        # Decoding here turns a malformed digest into a failure of this project
+        # instead of an error in the writer
+        hashes[filename] = {
+            algorithm: bytes.fromhex(hash_value)
+            for algorithm, hash_value in file_info["hashes"].items()
+        }
+        hash_algorithm_strs.update(file_info["hashes"])
+        if not filename.endswith(".whl"):
+            continue
+        parts = Wheel.parse_filename(filename)
+        if parts is None:
+            continue
+        wheel_parts[filename] = parts
+        _, version_str, build_tag_str, python_tag_str, abi_tag_str, platform_tag_str = (
+            parts
+        )
+        version_strs.add(version_str)
+        if build_tag_str:
+            build_tag_strs.add(build_tag_str)
+        python_tag_strs.add(python_tag_str)
+        abi_tag_strs.add(abi_tag_str)
+        platform_tag_strs.add(platform_tag_str)
+    return ParsedProject(
+        wheel_parts,
+        hashes,
+        version_strs,
+        build_tag_strs,
+        python_tag_strs,
+        abi_tag_strs,
+        platform_tag_strs,
+        hash_algorithm_strs,
+    )
+
+
+def prefetch_project(session, parsed: ParsedProject) -> None:
+    """
+    Make sure all versions, wheel tags, and hash algorithms of a project have ids.
+
+    The missing strings of each lookup table are created in bulk instead of once per
+    value.
+    """
+    _prefetch(session, _version_cache, Version, Version.version, parsed.version_strs)
+    _prefetch(
+        session,
+        _build_tag_cache,
+        BuildTag,
+        BuildTag.tag,
+        parsed.build_tag_strs,
+    )
+    _prefetch(
+        session,
+        _python_tag_cache,
+        PythonTag,
+        PythonTag.tag,
+        parsed.python_tag_strs,
+    )
+    _prefetch(session, _abi_tag_cache, AbiTag, AbiTag.tag, parsed.abi_tag_strs)
+    _prefetch(
+        session,
+        _platform_tag_cache,
+        PlatformTag,
+        PlatformTag.tag,
+        parsed.platform_tag_strs,
+    )
+    _prefetch(
+        session,
+        _hash_algorithm_cache,
+        HashAlgorithm,
+        HashAlgorithm.name,
+        parsed.hash_algorithm_strs,
+    )
 
 
 def _set_sqlite_pragma(dbapi_conn, connection_record):
@@ -465,53 +704,132 @@ def _set_sqlite_pragma(dbapi_conn, connection_record):
     cursor.execute("PRAGMA journal_mode=WAL")
     # NORMAL synchronous mode is safe with WAL and much faster
     cursor.execute("PRAGMA synchronous=NORMAL")
-    # 64MB cache size for better performance
-    cursor.execute("PRAGMA cache_size=-64000")
+    # 256MB cache size for better performance
+    cursor.execute("PRAGMA cache_size=-262144")
     # Store temporary tables in memory
     cursor.execute("PRAGMA temp_store=MEMORY")
+    # Memory-map up to 256MB of the database file to save read syscalls
+    cursor.execute("PRAGMA mmap_size=268435456")
     # Increase page size for better I/O (must be set before any tables exist)
     cursor.execute("PRAGMA page_size=4096")
     cursor.close()
 
 
-def load_tag_caches(session, error_console=None):
-    """Pre-load all existing tag strings into memory caches for fast lookups."""
-    if _version_cache.is_loaded():
-        return  # Already loaded
+def _column_types(connection, table_name: str) -> dict[str, str]:
+    """Return the declared types of the columns of a table, keyed by column name."""
+    return {
+        name: type_
+        for _, name, type_, *_ in connection.exec_driver_sql(
+            f"PRAGMA table_info({table_name})"
+        )
+    }
 
-    if error_console is not None:
-        error_console.print("Loading tag caches...", end=" ")
 
-    # Load all version strings
-    _version_cache.load_from_query(
-        session.execute(select(Version.version, Version.id)).all()
+def _migrate_hashes(connection):
+    """Move hash algorithms into their lookup table and store digests as bytes."""
+    if "algorithm" not in _column_types(connection, "hash"):
+        return
+    connection.exec_driver_sql(
+        "INSERT OR IGNORE INTO hash_algorithm (name) SELECT DISTINCT algorithm FROM hash"
     )
-
-    # Load all build tag strings
-    _build_tag_cache.load_from_query(
-        session.execute(select(BuildTag.tag, BuildTag.id)).all()
+    connection.exec_driver_sql("ALTER TABLE hash RENAME TO old_hash")
+    Hash.__table__.create(connection)
+    connection.connection.driver_connection.create_function(
+        "fromhex", 1, bytes.fromhex, deterministic=True
+    )
+    connection.exec_driver_sql(
+        "INSERT OR IGNORE INTO hash (id, file_id, algorithm_id, hash_value) "
+        "SELECT old_hash.id, old_hash.file_id, hash_algorithm.id, "
+        "fromhex(old_hash.hash_value) "
+        "FROM old_hash JOIN hash_algorithm ON hash_algorithm.name = old_hash.algorithm"
     )
+    connection.exec_driver_sql("DROP TABLE old_hash")
 
-    # Load all python tag strings
-    _python_tag_cache.load_from_query(
-        session.execute(select(PythonTag.tag, PythonTag.id)).all()
+
+def _migrate_project_status(connection):
+    """Replace the enum names in the project status column by small integers."""
+    if "CHAR" not in _column_types(connection, "project")["status"]:
+        return
+    connection.exec_driver_sql("ALTER TABLE project ADD COLUMN new_status SMALLINT")
+    connection.exec_driver_sql(
+        "UPDATE project SET new_status = ? WHERE status = ?",
+        [(i, status.name) for status, i in _STATUS_TO_INT.items()],
     )
+    connection.exec_driver_sql("ALTER TABLE project DROP COLUMN status")
+    connection.exec_driver_sql("ALTER TABLE project RENAME COLUMN new_status TO status")
 
-    # Load all abi tag strings
-    _abi_tag_cache.load_from_query(session.execute(select(AbiTag.tag, AbiTag.id)).all())
 
-    # Load all platform tag strings
-    _platform_tag_cache.load_from_query(
-        session.execute(select(PlatformTag.tag, PlatformTag.id)).all()
+def _migrate_log_entries(connection):
+    """Add the count of projects that failed to fetch to the log entries."""
+    if "num_failed_projects" in _column_types(connection, "log_entry"):
+        return
+    connection.exec_driver_sql(
+        "ALTER TABLE log_entry ADD COLUMN num_failed_projects INTEGER"
     )
 
+
+def _migrate(connection):
+    """
+    Convert a database created by an earlier version to the current schema.
+
+    create_all only adds missing tables, so tables whose columns changed are
+    converted here. Every step checks the schema first and does nothing for an
+    up-to-date database.
+    """
+    # pysqlite doesn't start transactions for DDL statements, so start one
+    # explicitly to make the whole migration atomic
+    connection.exec_driver_sql("BEGIN")
+    _migrate_hashes(connection)
+    _migrate_project_status(connection)
+    _migrate_log_entries(connection)
+    # Superseded by ix_file_project_id_filename, which starts with the same column
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_file_project_id")
+    # Indexes added to tables that already existed
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def _load_tag_cache(engine, tag_cache: TagCache, stmt):
+    """Fill a tag cache from a (string, id) query on its own connection."""
+    # Skip the ORM layer; plain rows are enough to build the dict from
+    with engine.connect() as connection:
+        tag_cache.load_from_query(connection.execute(stmt).all())
+
+
+def load_tag_caches(session, error_console=None):
+    """Pre-load all existing tag strings into memory caches for fast lookups."""
+    if _version_cache.is_loaded():
+        return  # Already loaded
+
+    if error_console is not None:
+        error_console.print("Loading tag caches...", end=" ")
+
+    # The tables are disjoint, so read them concurrently on separate connections
+    engine = session.get_bind()
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        futures = [
+            executor.submit(_load_tag_cache, engine, tag_cache, stmt)
+            for tag_cache, stmt in (
+                (_version_cache, select(Version.version, Version.id)),
+                (_build_tag_cache, select(BuildTag.tag, BuildTag.id)),
+                (_python_tag_cache, select(PythonTag.tag, PythonTag.id)),
+                (_abi_tag_cache, select(AbiTag.tag, AbiTag.id)),
+                (_platform_tag_cache, select(PlatformTag.tag, PlatformTag.id)),
+                (_hash_algorithm_cache, select(HashAlgorithm.name, HashAlgorithm.id)),
+            )
+        ]
+        for future in futures:
+            future.result()
+
     if error_console is not None:
         error_console.print(
             f"Loaded {_version_cache.size()} versions, "
             f"{_build_tag_cache.size()} build tags, "
             f"{_python_tag_cache.size()} python tags, "
             f"{_abi_tag_cache.size()} abi tags, "
-            f"{_platform_tag_cache.size()} platform tags"
+            f"{_platform_tag_cache.size()} platform tags, "
+            f"{_hash_algorithm_cache.size()} hash algorithms"
         )
 
 
@@ -526,10 +844,17 @@ def init_db(error_console: Console = None) -> sessionmaker:
             },
             pool_size=10,
             max_overflow=20,
+            insertmanyvalues_page_size=10_000,
         )
         # Set SQLite pragmas on each connection
         event.listen(engine, "connect", _set_sqlite_pragma)
     Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        _migrate(connection)
+    # Let SQLite refresh the query planner statistics of tables where they are stale;
+    # unlike a full ANALYZE this is cheap enough to do on every start
+    with engine.connect() as connection:
+        connection.exec_driver_sql("PRAGMA optimize")
     Session = sessionmaker(engine)
 
     # Pre-load tag caches for performance
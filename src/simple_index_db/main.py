@@ -1,11 +1,11 @@
-import re
+import asyncio
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from importlib.metadata import version
 from queue import Empty, Queue
-from threading import Thread
 
 import typer
-from requests.exceptions import HTTPError
 from rich.console import Console
 from sqlalchemy import select, func
 
@@ -19,14 +19,30 @@ from .db import (
     LogEntry,
     Project,
     Wheel,
+    execute_in_chunks,
     init_db,
+    parse_project,
 )
-from .pypi_client import PyPIClient
+from .pypi_client import AsyncPyPIClient, PyPIClient
 
 app = typer.Typer()
 
 error_console = Console(stderr=True)
 
+_NORMALIZE_TABLE = str.maketrans("_.", "--")
+
+# Maximum number of requests to PyPI in flight at the same time
+MAX_CONCURRENT_REQUESTS = 64
+
+# Longest changelog to use instead of the full project list
+MAX_CHANGELOG_EVENTS = 10_000
+
+# Maximum number of projects written together, and per commit
+BATCH_SIZE = 1000
+
+# Put into the project info queue once all projects have been fetched
+_DONE = object()
+
 
 def normalize(name):
     """
@@ -38,7 +54,14 @@ def normalize(name):
     :param name: The project name to normalize.
     :return: The normalized project name.
     """
-    return re.sub(r"[-_.]+", "-", name).lower()
+    # Most names on PyPI are already normalized
+    if name.islower() and "_" not in name and "." not in name and "--" not in name:
+        return name
+    name = name.translate(_NORMALIZE_TABLE).lower()
+    # Collapse runs of separators; most names have none, so the loop rarely runs
+    while "--" in name:
+        name = name.replace("--", "-")
+    return name
 
 
 def get_project_list():
@@ -54,111 +77,256 @@ def get_project_list():
     return client.get_project_list()
 
 
-def get_project_info(input_queue, output_queue):
+def get_project_infos(input_queue, output_queue):
     """
-    Worker function to get project info from PyPI.
+    Fetch project infos from PyPI with many concurrent requests.
+
+    Takes project names from the input_queue deque, fetches their info from PyPI, parses
+    it, and puts the project info dictionaries into the output_queue together with
+    the parse results, so that the single database writer only has to write.
+    Puts _DONE into the output_queue once all projects have been fetched.
 
-    Reads project names from the input_queue, fetches their info from PyPI,
-    and puts the project info dictionaries into the output_queue.
+    :return: The number of projects that could not be fetched.
     """
-    client = PyPIClient()
-    while True:
-        try:
-            project_name = input_queue.get(block=False)
-        except Empty:
-            break
-        try:
-            project = client.get_project(project_name)
-            output_queue.put(project)
-        except HTTPError:
-            print(f"Failed to fetch project {project_name}")
-        input_queue.task_done()
+    try:
+        return asyncio.run(_get_project_infos(input_queue, output_queue))
+    finally:
+        output_queue.put(_DONE)
+
+
+async def _get_project_infos(input_queue, output_queue):
+    num_failed_projects = 0
+    async with AsyncPyPIClient(MAX_CONCURRENT_REQUESTS) as client:
+
+        async def worker():
+            nonlocal num_failed_projects
+            while True:
+                try:
+                    project_name = input_queue.popleft()
+                except IndexError:
+                    break
+                try:
+                    project_last_serial, project_info = await client.get_project(
+                        project_name
+                    )
+                    parsed = parse_project(project_info)
+                except Exception as e:
+                    # A broken response must not stop fetching the other projects
+                    print(f"Failed to fetch project {project_name}: {e!r}")
+                    num_failed_projects += 1
+                    continue
+                # The output queue is bounded; wait for room without blocking the
+                # event loop
+                await asyncio.to_thread(
+                    output_queue.put, (project_last_serial, project_info, parsed)
+                )
+
+        await asyncio.gather(*(worker() for _ in range(MAX_CONCURRENT_REQUESTS)))
+    return num_failed_projects
+
+
+def _split_projects(local_projects, projects):
+    """
+    Split projects into those to update and those to add.
+
+    :param local_projects: Dict of normalized name to last serial in the local database.
+    :param projects: Iterable of (normalized name, last serial) pairs from PyPI.
+    :return: A tuple of deques of project names (projects_to_update, projects_to_add).
+    """
+    projects_to_update = deque()
+    projects_to_add = deque()
+    for name, last_serial in projects:
+        old_last_serial = local_projects.get(name)
+        if old_last_serial is None:
+            projects_to_add.append(name)
+        elif old_last_serial < last_serial:
+            projects_to_update.append(name)
+    return projects_to_update, projects_to_add
+
+
+def _find_changed_projects(Session, last_serial_repo):
+    """
+    Find the projects that changed on PyPI after the given serial from the changelog.
+
+    :param Session: The SQLAlchemy session factory.
+    :param last_serial_repo: The last serial of the previous update.
+    :return: A tuple of (repo_last_serial, None, projects_to_update,
+             projects_to_add), or None if the changelog could not be used. The
+             changelog doesn't tell the total number of projects on PyPI.
+    """
+    try:
+        events = PyPIClient().get_changelog_since_serial(last_serial_repo)
+    except Exception as e:
+        # Falling back to the full project list is always possible
+        error_console.print(f"Failed to fetch the changelog: {e!r}")
+        return None
+    if len(events) > MAX_CHANGELOG_EVENTS:
+        return None
+    # Events are ordered by serial, so the last event of each project wins
+    changed_projects = {}
+    for name, _, _, action, serial in events:
+        name = normalize(name)
+        if action == "remove project":
+            changed_projects.pop(name, None)
+        else:
+            changed_projects[name] = serial
+    repo_last_serial = events[-1][4] if events else last_serial_repo
+    with Session() as session:
+        local_projects = dict(
+            execute_in_chunks(
+                session,
+                lambda chunk: select(Project.name, Project.last_serial).where(
+                    Project.name.in_(chunk)
+                ),
+                changed_projects,
+            )
+        )
+    projects_to_update, projects_to_add = _split_projects(
+        local_projects, changed_projects.items()
+    )
+    return repo_last_serial, None, projects_to_update, projects_to_add
+
+
+def _find_listed_projects(Session):
+    """
+    Find the projects that changed on PyPI by comparing with the full project list.
+
+    :param Session: The SQLAlchemy session factory.
+    :return: A tuple of (repo_last_serial, num_projects, projects_to_update,
+             projects_to_add).
+    """
+    repo_last_serial, projects = get_project_list()
+    with Session() as session:
+        # Stream the local projects instead of materializing all rows first
+        local_projects = {
+            name: last_serial
+            for name, last_serial in session.execute(
+                select(Project.name, Project.last_serial).execution_options(
+                    yield_per=10_000
+                )
+            )
+        }
+    # Single pass over the much larger PyPI listing, dispatching each project
+    projects_to_update, projects_to_add = _split_projects(
+        local_projects,
+        (
+            (normalize(project_info["name"]), project_info["_last-serial"])
+            for project_info in projects
+        ),
+    )
+    return repo_last_serial, len(projects), projects_to_update, projects_to_add
 
 
 def find_projects_to_update(Session):
     """
     Find projects that need to be updated or added in the local database.
 
-    Compares the local database with the PyPI project list to determine which projects
-    need to be updated (i.e., their last serial number has increased) or added (i.e., they are new projects).
+    Compares the local database with PyPI to determine which projects need to be
+    updated (i.e., their last serial number has increased) or added (i.e., they are new projects).
+    If every project could be fetched in the last update, only the changelog since
+    then is fetched, unless it is too long; otherwise the full PyPI project list is
+    used, so that projects which failed before are retried.
 
     :param Session: The SQLAlchemy session factory.
     :return: A tuple containing:
-             - num_projects: Total number of projects on PyPI.
+             - repo_last_serial: Last serial of the PyPI repository covered by the result.
+             - num_projects: Total number of projects on PyPI, or None if only the
+               changelog was fetched.
              - num_projects_to_update: Number of projects that need to be updated.
-             - projects_to_update: Queue of project names to update.
+             - projects_to_update: Deque of project names to update.
              - num_projects_to_add: Number of new projects to add.
-             - projects_to_add: Queue of project names to add.
+             - projects_to_add: Deque of project names to add.
     """
-    repo_last_serial, projects = get_project_list()
-    new_projects = {
-        normalize(project_info["name"]): project_info["_last-serial"]
-        for project_info in projects
-    }
-    projects_to_update = Queue()
-    num_projects = len(projects)
-    num_projects_to_update = 0
     with Session() as session:
-        for name, old_last_serial in session.execute(
-            select(Project.name, Project.last_serial)
-        ):
-            try:
-                new_last_serial = new_projects.pop(name)
-            except KeyError:
-                continue
-            if old_last_serial < new_last_serial:
-                projects_to_update.put(name)
-                num_projects_to_update += 1
-    projects_to_add = Queue()
-    num_projects_to_add = 0
-    for name in new_projects.keys():
-        projects_to_add.put(name)
-        num_projects_to_add += 1
+        last_update = session.execute(
+            select(LogEntry.last_serial_repo, LogEntry.num_failed_projects)
+            .order_by(LogEntry.ts.desc())
+            .limit(1)
+        ).one_or_none()
+    changes = None
+    # Projects that failed to fetch don't show up in later changelogs, and older log
+    # entries don't record failures at all
+    if last_update is not None and last_update.num_failed_projects == 0:
+        changes = _find_changed_projects(Session, last_update.last_serial_repo)
+    if changes is None:
+        changes = _find_listed_projects(Session)
+    repo_last_serial, num_projects, projects_to_update, projects_to_add = changes
     return (
         repo_last_serial,
         num_projects,
-        num_projects_to_update,
+        len(projects_to_update),
         projects_to_update,
-        num_projects_to_add,
+        len(projects_to_add),
         projects_to_add,
     )
 
 
-def process_updates(Session, project_queue, num_projects, update=False):
-    project_info_queue = Queue()
-    for _ in range(4):
-        Thread(
-            target=get_project_info,
-            args=(project_queue, project_info_queue),
-        ).start()
-    start = time.time()
+def _drain(queue, max_items, max_wait=0.5):
+    """
+    Take up to max_items items from the queue, collecting for at most max_wait seconds.
+
+    Blocks until the first item arrives. Waiting a little for more items lets the
+    writer handle larger batches, which cost about as many statements as small ones.
+
+    :return: A tuple of (items, done), where done is True if _DONE was received.
+    """
+    items = []
+    item = queue.get()
+    deadline = time.monotonic() + max_wait
+    while item is not _DONE:
+        items.append(item)
+        if len(items) >= max_items:
+            return items, False
+        try:
+            item = queue.get(timeout=max(0, deadline - time.monotonic()))
+        except Empty:
+            return items, False
+    return items, True
+
+
+def process_updates(Session, project_queue, num_projects):
+    # Bounded, so that fetching cannot run arbitrarily far ahead of writing
+    project_info_queue = Queue(maxsize=BATCH_SIZE)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        fetcher = executor.submit(get_project_infos, project_queue, project_info_queue)
+        try:
+            _write_updates(Session, project_info_queue, num_projects)
+        except BaseException:
+            # Stop fetching and make room in the queue, so the fetcher can finish
+            project_queue.clear()
+            while not fetcher.done():
+                try:
+                    project_info_queue.get(timeout=0.1)
+                except Empty:
+                    pass
+            raise
+        # Re-raise an error that stopped the fetching, so the update isn't logged
+        return fetcher.result()
+
+
+def _write_updates(Session, project_info_queue, num_projects):
+    start = last_report = time.monotonic()
     num_updated_projects = 0
+    num_uncommitted_projects = 0
     with Session() as session:
-        while True:
-            try:
-                project_last_serial, project_info = project_info_queue.get(timeout=1)
-                if update:
-                    project = session.execute(
-                        select(Project).filter_by(name=project_info["name"])
-                    ).scalar_one_or_none()
-                else:
-                    project = None
-                if project is None:
-                    project = Project.from_info(
-                        session, project_last_serial, project_info
-                    )
-                    session.add(project)
-                else:
-                    project.update_from_info(session, project_last_serial, project_info)
-                project_info_queue.task_done()
-                num_updated_projects += 1
-            except Empty:
-                if project_queue.empty():
-                    break
-            if num_updated_projects % 100 == 0:
+        done = False
+        while not done:
+            batch, done = _drain(project_info_queue, BATCH_SIZE)
+            if not batch:
+                continue
+            # New and updated projects are written together with one statement
+            # per table
+            Project.bulk_ingest(session, batch)
+            num_updated_projects += len(batch)
+            num_uncommitted_projects += len(batch)
+            if num_uncommitted_projects >= BATCH_SIZE:
                 session.commit()
-                end = time.time()
-                elapsed = end - start
+                num_uncommitted_projects = 0
+            now = time.monotonic()
+            # Report progress at most once per second
+            if now - last_report >= 1.0:
+                last_report = now
+                elapsed = now - start
                 percent = num_updated_projects / num_projects * 100.0
                 error_console.print(
                     f"Updated {num_updated_projects}/{num_projects} projects ({percent:.2f}%) "
@@ -168,7 +336,13 @@ def process_updates(Session, project_queue, num_projects, update=False):
     error_console.print(f"Committed {num_updated_projects} updated projects")
 
 
-def _log_update(Session, last_serial_repo, num_updated_projects, num_added_projects):
+def _log_update(
+    Session,
+    last_serial_repo,
+    num_updated_projects,
+    num_added_projects,
+    num_failed_projects,
+):
     with Session() as session:
         last_serial_data = session.execute(
             select(func.max(Project.last_serial))
@@ -183,6 +357,7 @@ def _log_update(Session, last_serial_repo, num_updated_projects, num_added_proje
             num_updated_projects=num_updated_projects,
             num_added_projects=num_added_projects,
             num_total_projects=num_total_projects,
+            num_failed_projects=num_failed_projects,
         )
         session.add(log_entry)
         session.commit()
@@ -199,13 +374,24 @@ def update_db():
         num_projects_to_add,
         projects_to_add,
     ) = find_projects_to_update(Session)
-    error_console.print(f"Total projects on PyPI: {num_projects}")
+    if num_projects is not None:
+        error_console.print(f"Total projects on PyPI: {num_projects}")
     error_console.print(f"Projects to update: {num_projects_to_update}")
     error_console.print(f"Projects to add: {num_projects_to_add}")
 
-    process_updates(Session, projects_to_update, num_projects_to_update, update=True)
-    process_updates(Session, projects_to_add, num_projects_to_add, update=False)
-    _log_update(Session, last_serial_repo, num_projects_to_update, num_projects_to_add)
+    num_failed_projects = process_updates(
+        Session, projects_to_update, num_projects_to_update
+    )
+    num_failed_projects += process_updates(
+        Session, projects_to_add, num_projects_to_add
+    )
+    _log_update(
+        Session,
+        last_serial_repo,
+        num_projects_to_update,
+        num_projects_to_add,
+        num_failed_projects,
+    )
 
 
 def _setup_output_console():
@@ -226,13 +412,12 @@ def _find_ready_packages(session):
             & ((AbiTag.tag.like("%cp314t")) | (AbiTag.tag.like("%cp314td")))
         )
     )
-    pkgs = session.scalars(stmt).all()
-    ready_packages = []
-    for conda_pkg, pypi_pkgs in get_conda_packages().items():
-        if pypi_pkgs is None:
-            continue
-        if all([pypi_pkg in pkgs for pypi_pkg in pypi_pkgs]):
-            ready_packages.append(conda_pkg)
+    pkgs = set(session.scalars(stmt))
+    ready_packages = [
+        conda_pkg
+        for conda_pkg, pypi_pkgs in get_conda_packages().items()
+        if pypi_pkgs is not None and all(pypi_pkg in pkgs for pypi_pkg in pypi_pkgs)
+    ]
     return ready_packages
 
 
@@ -1,14 +1,23 @@
-import requests
+import xmlrpc.client
+
+import httpx
+import orjson
+
+# httpx advertises every compression it can decode in Accept-Encoding, which
+# includes brotli and zstd through the corresponding extras
+SIMPLE_API_HEADERS = {"Accept": "application/vnd.pypi.simple.v1+json"}
+SIMPLE_API_URL = "https://pypi.org/simple/"
 
 
 class PyPIClient:
     """Client for interacting with the PyPI Simple API."""
 
     def __init__(self):
-        self.base_url = "https://pypi.org/simple/"
-        self.session = requests.Session()
+        self.base_url = SIMPLE_API_URL
+        self.session = httpx.Client(http2=True, timeout=30, headers=SIMPLE_API_HEADERS)
 
-    def check_meta(self, meta: dict[str, str]) -> int:
+    @staticmethod
+    def check_meta(meta: dict[str, str]) -> int:
         """Check the metadata of a PyPI response."""
         major, minor = map(int, meta["api-version"].split("."))
         assert major == 1 and minor >= 4, (
@@ -16,35 +25,76 @@ class PyPIClient:
         )
         return int(meta["_last-serial"])
 
-    def get_project_list(self) -> tuple[int, list[dict[str, int | str]]]:
-        """Fetch the list of all PyPI projects."""
-        response = self.session.get(
-            self.base_url,
-            headers={"Accept": "application/vnd.pypi.simple.v1+json"},
-        )
+    @classmethod
+    def check_response(cls, response: httpx.Response) -> tuple[int, dict]:
+        """
+        Check and decode a PyPI Simple API response.
+
+        :return: The last serial and the JSON body without its metadata.
+        """
         response.raise_for_status()
         header_last_serial = int(response.headers.get("x-pypi-last-serial"))
-        json_body = response.json()
-        body_last_serial = self.check_meta(json_body["meta"])
+        json_body = orjson.loads(response.content)
+        body_last_serial = cls.check_meta(json_body.pop("meta"))
         assert body_last_serial == header_last_serial, (
             "Header last serial does not match body last serial"
         )
-        overall_last_serial = body_last_serial
+        return (body_last_serial, json_body)
+
+    def get_project_list(self) -> tuple[int, list[dict[str, int | str]]]:
+        """Fetch the list of all PyPI projects."""
+        response = self.session.get(self.base_url)
+        overall_last_serial, json_body = self.check_response(response)
         return (overall_last_serial, json_body["projects"])
 
     def get_project(self, project_name: str):
         """Fetch details for a specific PyPI project."""
         url = f"{self.base_url}{project_name}/"
-        response = self.session.get(
-            url,
-            headers={"Accept": "application/vnd.pypi.simple.v1+json"},
+        return self.check_response(self.session.get(url))
+
+    def get_changelog_since_serial(
+        self, serial: int
+    ) -> list[tuple[str, str | None, int, str, int]]:
+        """
+        Fetch all changelog events on PyPI after the given serial.
+
+        :param serial: The last serial that is already known.
+        :return: A list of (name, version, timestamp, action, serial) tuples, where
+                 the name is *not* normalized.
+        """
+        response = self.session.post(
+            "https://pypi.org/pypi",
+            content=xmlrpc.client.dumps((serial,), "changelog_since_serial"),
+            headers={"Accept": "text/xml", "Content-Type": "text/xml"},
         )
         response.raise_for_status()
-        header_last_serial = int(response.headers.get("x-pypi-last-serial"))
-        json_body = response.json()
-        body_last_serial = self.check_meta(json_body.pop("meta"))
-        assert body_last_serial == header_last_serial, (
-            "Header last serial does not match body last serial"
+        (events,), _ = xmlrpc.client.loads(response.content)
+        return events
+
+
+class AsyncPyPIClient:
+    """Asynchronous client for fetching many projects from the PyPI Simple API."""
+
+    def __init__(self, max_connections: int = 64):
+        self.base_url = SIMPLE_API_URL
+        # HTTP/2 multiplexes the concurrent requests over few connections
+        self.client = httpx.AsyncClient(
+            http2=True,
+            timeout=30,
+            headers=SIMPLE_API_HEADERS,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
         )
-        project_last_serial = body_last_serial
-        return (project_last_serial, json_body)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.client.aclose()
+
+    async def get_project(self, project_name: str):
+        """Fetch details for a specific PyPI project."""
+        url = f"{self.base_url}{project_name}/"
+        return PyPIClient.check_response(await self.client.get(url))